@@ -815,6 +815,42 @@ def massive_update_job(session, jobs, flag="D"):
             pass
     return
 
+def massive_update_or_insert_job(session, day, pairs, jobtype, flag="T"):
+    """
+    Sets `flag` on the (`day`, `pair`, `jobtype`)
+    :class:`~msnoise.msnoise_table_def.declare_tables.Job` for all `pairs`
+    with one UPDATE statement and one bulk INSERT for the missing rows,
+    instead of one update_job() roundtrip per pair.
+
+    :type day: str
+    :param day: The day in YYYY-MM-DD format
+    :type pairs: list
+    :param pairs: list of pair names
+    :type jobtype: str
+    :param jobtype: CrossCorrelation (CC) or dt/t (DTT) Job?
+    :type flag: str
+    :param flag: Status of the Job: "T"odo, "I"n Progress, "D"one.
+    """
+    existing = set(
+        pair for pair, in session.query(Job.pair).
+            filter(Job.day == day).
+            filter(Job.jobtype == jobtype).
+            filter(Job.pair.in_(pairs)).all())
+    if len(existing):
+        session.query(Job).\
+            filter(Job.day == day).\
+            filter(Job.jobtype == jobtype).\
+            filter(Job.pair.in_(existing)).\
+            update({Job.flag: flag,
+                    Job.lastmod: datetime.datetime.utcnow()},
+                   synchronize_session=False)
+    missing = [{"day": day, "pair": pair, "jobtype": jobtype, "flag": flag}
+               for pair in pairs if pair not in existing]
+    if len(missing):
+        session.bulk_insert_mappings(Job, missing)
+    session.commit()
+
+
 def is_next_job(session, flag='T', jobtype='CC'):
     """
     Are there any :class:`~msnoise.msnoise_table_def.declare_tables.Job` in the database,
@@ -860,6 +896,27 @@ def get_next_job(session, flag='T', jobtype='CC', limit=99999):
     :returns: list of :class:`~msnoise.msnoise_table_def.declare_tables.Job`
     """
     from sqlalchemy import update
+
+    # On PostgreSQL, MySQL >= 8 and MariaDB >= 10.6, SKIP LOCKED lets
+    # parallel workers claim different rows instead of queuing on each
+    # other's row locks. SQLite (and older MySQL/MariaDB) keep the plain
+    # FOR UPDATE behaviour. MariaDB also reports as "mysql", so check its
+    # own version attribute (the raw server_version_info of a prefixed
+    # "5.5.5-10.5.8-MariaDB" string would wrongly pass the MySQL test).
+    dialect = session.bind.dialect
+    if dialect.name == "postgresql":
+        skip_locked = True
+    elif dialect.name == "mysql":
+        if getattr(dialect, "is_mariadb", False):
+            version = getattr(dialect, "_mariadb_normalized_version_info",
+                              None)
+            skip_locked = version is not None and version >= (10, 6)
+        else:
+            version = getattr(dialect, "server_version_info", None)
+            skip_locked = version is not None and version >= (8,)
+    else:
+        skip_locked = False
+
     tmp = []
     while not len(tmp):
         jobs = session.query(Job).filter(Job.jobtype == jobtype).\
@@ -868,7 +925,7 @@ def get_next_job(session, flag='T', jobtype='CC', limit=99999):
                    with_hint(Job, 'USE INDEX (job_index)').
                    filter(Job.jobtype == jobtype).
                    filter(Job.flag == flag).first().day).\
-            limit(limit).with_for_update()
+            limit(limit).with_for_update(skip_locked=skip_locked)
         # print(jobs.statement.compile(compile_kwargs={"literal_binds": True}))
         tmp = jobs.all()
         refs = [_.ref for _ in tmp]
@@ -1,15 +1,14 @@
+import functools
 import logging
 
 
 import numpy as np
 import scipy
-if scipy.__version__ < "1.4.0":
-    import scipy.fftpack as sf
-    from scipy.fftpack.helper import next_fast_len
-    import scipy.fftpack._fftpack as sff
-else:
-    import scipy.fft as sf
-    from scipy.fft import next_fast_len
+# scipy.fft (pocketfft, scipy >= 1.4) only: myCorr2/psd2 rely on its
+# half-spectrum rfft layout and the workers= argument, which the legacy
+# fftpack interface does not provide
+import scipy.fft as sf
+from scipy.fft import next_fast_len
 
 import scipy.optimize
 import scipy.signal
@@ -17,6 +16,11 @@ from scipy.stats import scoreatpercentile
 from obspy.signal.invsim import cosine_taper
 from obspy.signal.regression import linear_regression
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 
 
 def myCorr(data, maxlag, plot=False, nfft=None):
@@ -77,14 +81,42 @@ def myCorr(data, maxlag, plot=False, nfft=None):
     return corr
 
 
-def myCorr2(data, maxlag, energy, index, plot=False, nfft=None, 
+def _cross_spectra_numpy(data, idx1, idx2, energy, normalized, out):
+    if normalized:
+        # normalize the N spectra once instead of scaling each of the
+        # O(N^2) pair products: for dense pair sets this is the dominant
+        # part of the per-pair work
+        data = data / energy[:, np.newaxis]
+    np.conj(data[idx1], out=out)
+    out *= data[idx2]
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _cross_spectra(data, idx1, idx2, energy, normalized, out):
+        for k in prange(idx1.shape[0]):
+            i = idx1[k]
+            j = idx2[k]
+            if normalized:
+                out[k] = np.conj(data[i]) * data[j] / (energy[i] * energy[j])
+            else:
+                out[k] = np.conj(data[i]) * data[j]
+else:
+    _cross_spectra = _cross_spectra_numpy
+
+# cross-spectrum buffers reused across myCorr2 calls (one per shape/dtype)
+_cross_buffers = {}
+
+
+def myCorr2(data, maxlag, energy, index, plot=False, nfft=None,
             normalized=False):
     """This function takes ndimensional *data* array, computes the
     cross-correlation in the frequency domain and returns the cross-correlation
     function between [-*maxlag*:*maxlag*].
 
     :type data: :class:`numpy.ndarray`
-    :param data: This array contains the fft of each timeseries to be cross-correlated.
+    :param data: This array contains the rfft (half-spectrum) of each
+        timeseries to be cross-correlated.
     :type maxlag: int
     :param maxlag: This number defines the number of samples (N=2*maxlag + 1) of the CCF that will be returned.
 
@@ -94,25 +126,40 @@ def myCorr2(data, maxlag, energy, index, plot=False, nfft=None,
     # TODO: docsting
 
     maxlag = np.round(maxlag)
-    Nt = data.shape[1]
+    if nfft is None:
+        nfft = 2 * (data.shape[1] - 1)
+    Nt = nfft
 
-    if maxlag != Nt:
-        tcorr = np.arange(-Nt + 1, Nt)
-        dN = np.where(np.abs(tcorr) <= maxlag)[0]
     corrs = {}
-    for id, sta1, sta2 in index:
-        corr = np.conj(data[sta1]) * data[sta2]
-        corr = np.real(sf.ifft(corr, nfft)) / Nt
-        corr = np.concatenate((corr[-Nt + 1:], corr[:Nt + 1]))
+    if not len(index):
+        return corrs
+
+    idx1 = np.asarray([sta1 for _, sta1, _ in index], dtype=np.int64)
+    idx2 = np.asarray([sta2 for _, _, sta2 in index], dtype=np.int64)
+    if energy is None:
+        energy = np.ones(data.shape[0])
 
-        if normalized:
-            corr /= (energy[sta1] * energy[sta2])
+    key = (len(index), data.shape[1], data.dtype.str)
+    buf = _cross_buffers.get(key)
+    if buf is None:
+        if len(_cross_buffers) > 8:
+            _cross_buffers.clear()
+        buf = np.empty((len(index), data.shape[1]), dtype=data.dtype)
+        _cross_buffers[key] = buf
 
-        if maxlag != Nt:
-            corr = corr[dN]
-        if len(corr) < (2*maxlag)+1:
-            continue
-        corrs[id] = corr
+    _cross_spectra(data, idx1, idx2, np.asarray(energy), normalized, buf)
+
+    corr = sf.irfft(buf, nfft, axis=1, workers=-1) / Nt
+    corr = np.concatenate((corr[:, -Nt + 1:], corr[:, :Nt + 1]), axis=1)
+
+    if maxlag != Nt:
+        tcorr = np.arange(-Nt + 1, Nt)
+        dN = np.where(np.abs(tcorr) <= maxlag)[0]
+        corr = corr[:, dN]
+    if corr.shape[1] < (2 * maxlag) + 1:
+        return corrs
+    for k, (id, _, _) in enumerate(index):
+        corrs[id] = corr[k]
 
     return corrs
 
@@ -139,6 +186,76 @@ def pcc_xcorr(data, maxlag, energy, index, plot=False, nfft=None,
                          parallel=True)
     return corr
 
+@functools.lru_cache(maxsize=8)
+def _hann(nfft):
+    """Cached Hann taper: the window only depends on nfft, no need to
+    rebuild it every slide. Treated as read-only by the callers."""
+    return scipy.signal.windows.hann(nfft)
+
+
+def psd2(data, fs, nfft):
+    """This function takes a 2D *data* array (one time series per row) and
+    computes the amplitude spectral density of every row at once, using a
+    batched Welch estimate (Hann window, 50% overlap). The output matches
+    ``sqrt(matplotlib.mlab.psd(row, Fs=fs, NFFT=nfft, detrend='mean'))``
+    but segments all rows in one strided view and runs a single
+    multi-threaded rFFT instead of one FFT call per trace.
+
+    :type data: :class:`numpy.ndarray`
+    :param data: 2D array containing the time series to process (one per row)
+    :type fs: float
+    :param fs: The sampling frequency of the `data`
+    :type nfft: int
+    :param nfft: The number of points to compute the FFT
+
+    :rtype: :class:`numpy.ndarray`
+    :returns: 2D array (ntraces x nfft//2+1) containing the square root of
+        the PSD of each row
+    """
+    win = _hann(nfft)
+    npts = data.shape[1]
+    if npts < nfft:
+        # shorter than one segment: zero-pad, like mlab.psd does
+        seg = np.zeros((data.shape[0], 1, nfft), dtype=data.dtype)
+        seg[:, 0, :npts] = data
+    else:
+        seg = np.lib.stride_tricks.sliding_window_view(data, nfft, axis=1)
+        seg = np.array(seg[:, ::nfft // 2])
+    seg -= seg.mean(axis=-1, keepdims=True)
+    seg *= win
+    X = sf.rfft(seg, n=nfft, axis=-1, workers=-1)
+    psd = (np.abs(X) ** 2).mean(axis=1)
+    # one-sided density: double all bins except DC (and Nyquist if present)
+    if nfft % 2 == 0:
+        psd[:, 1:-1] *= 2.0
+    else:
+        psd[:, 1:] *= 2.0
+    psd /= fs * (win ** 2).sum()
+    return np.sqrt(psd)
+
+
+@functools.lru_cache(maxsize=32)
+def _whiten_bins(Nfft, delta, freqmin, freqmax):
+    """Frequency bin bounds (low, porte1, porte2, high) used by whiten().
+    These only depend on the FFT length, the sample spacing and the filter
+    band, so they are computed once and cached rather than rebuilt (fftfreq
+    + np.where) for every trace and window."""
+    Napod = 100
+    freqVec = sf.fftfreq(Nfft, d=delta)[:Nfft // 2]
+
+    J = np.where((freqVec >= freqmin) & (freqVec <= freqmax))[0]
+    low = J[0] - Napod
+    if low <= 0:
+        low = 1
+
+    porte1 = J[0]
+    porte2 = J[-1]
+    high = J[-1] + Napod
+    if high > Nfft / 2:
+        high = int(Nfft // 2)
+    return low, porte1, porte2, high
+
+
 def whiten(data, Nfft, delta, freqmin, freqmax, plot=False):
     """This function takes 1-dimensional *data* timeseries array,
     goes to frequency domain using fft, whitens the amplitude of the spectrum
@@ -169,20 +286,8 @@ def whiten(data, Nfft, delta, freqmin, freqmax, plot=False):
         plt.xlim(0, len(data) * delta)
         plt.title('Input trace')
 
-    Napod = 100
     Nfft = int(Nfft)
-    freqVec = sf.fftfreq(Nfft, d=delta)[:Nfft // 2]
-
-    J = np.where((freqVec >= freqmin) & (freqVec <= freqmax))[0]
-    low = J[0] - Napod
-    if low <= 0:
-        low = 1
-
-    porte1 = J[0]
-    porte2 = J[-1]
-    high = J[-1] + Napod
-    if high > Nfft / 2:
-        high = int(Nfft // 2)
+    low, porte1, porte2, high = _whiten_bins(Nfft, delta, freqmin, freqmax)
 
     FFTRawSign = sf.fft(data, Nfft)
 
@@ -235,13 +340,12 @@ def whiten(data, Nfft, delta, freqmin, freqmax, plot=False):
 
 
 def whiten2(fft, Nfft, low, high, porte1, porte2, psds, whiten_type):
-    """This function takes 1-dimensional *data* timeseries array,
-    goes to frequency domain using fft, whitens the amplitude of the spectrum
-    in frequency domain between *freqmin* and *freqmax*
-    and returns the whitened fft.
+    """This function takes a 2D array containing the rfft (half-spectrum) of
+    each time series (one per row), and whitens the amplitude of the spectrum
+    in frequency domain between *freqmin* and *freqmax*, in place.
 
-    :type data: :class:`numpy.ndarray`
-    :param data: Contains the 1D time series to whiten
+    :type fft: :class:`numpy.ndarray`
+    :param fft: Contains the rfft of the time series to whiten (one per row)
     :type Nfft: int
     :param Nfft: The number of points to compute the FFT
     :type delta: float
@@ -265,8 +369,8 @@ def whiten2(fft, Nfft, low, high, porte1, porte2, psds, whiten_type):
     taper *= taper
     for i in range(fft.shape[0]):
         if whiten_type == "PSD":
-            fft[i][:Nfft//2+1] /= psds[i]
-            fft[i][:Nfft//2+1] *= taper
+            fft[i] /= psds[i]
+            fft[i] *= taper
             tmp = fft[i, porte1:porte2]
             imin = scoreatpercentile(tmp, 5)
             imax = scoreatpercentile(tmp, 95)
@@ -286,9 +390,6 @@ def whiten2(fft, Nfft, low, high, porte1, porte2, psds, whiten_type):
             fft[i,porte2:high] = np.cos(np.linspace(0., np.pi / 2., high - porte2)) ** 2 * np.exp(1j * np.angle(fft[i,porte2:high]))
             fft[i,high:] *= 0
 
-        # Hermitian symmetry (because the input is real)
-        fft[i,-(Nfft // 2) + 1:] = np.conjugate(fft[i,1:(Nfft // 2)])[::-1]
-
 
 
 def smooth(x, window='boxcar', half_win=3):
@@ -192,23 +192,289 @@ could occur with SQLite.
 
 """
 #TODO docstring
+import functools
 import sys
 import time
-
-import matplotlib.mlab as mlab
+from concurrent.futures import ProcessPoolExecutor
 
 from .api import *
+
+# pocketfft, multithreaded via workers=: no legacy fftpack fallback here
+import scipy.fft as sf
+from scipy.fft import next_fast_len
+
 from .move2obspy import myCorr2
+from .move2obspy import psd2
 from .move2obspy import whiten2
 from .move2obspy import pcc_xcorr
 
 from .preprocessing import preprocess
 
-from scipy.stats import scoreatpercentile
 from obspy.signal.filter import bandpass
 
 import logbook
 
+
+@functools.lru_cache(maxsize=8)
+def _whiten_bounds(nfft, dt, filters_key, napod):
+    """Precomputes, per filter, the whitening bounds (low, high, p1, p2)
+    in rFFT bin indices. These only depend on the FFT length, the sample
+    spacing and the filter set, so they are cached and cost nothing in
+    the slide loop as long as ``nfft`` does not change."""
+    freq_vec = sf.fftfreq(nfft, d=dt)[:nfft // 2]
+    bounds = {}
+    for ref, filterlow, filterhigh in filters_key:
+        freq_sel = np.where((freq_vec >= filterlow) &
+                            (freq_vec <= filterhigh))[0]
+        low = freq_sel[0] - napod
+        if low <= 0:
+            low = 0
+        p1 = freq_sel[0]
+        p2 = freq_sel[-1]
+        high = freq_sel[-1] + napod
+        if high > nfft / 2:
+            high = int(nfft // 2)
+        bounds[ref] = (low, high, p1, p2)
+    return bounds
+
+
+@functools.lru_cache(maxsize=8)
+def _taper(npts, max_percentage):
+    """Same cosine taper as ``Stream.taper(max_percentage)``, built once per
+    window length so it can be applied to the whole data matrix in a single
+    multiply instead of trace per trace through ObsPy."""
+    wlen = min(int(max_percentage * npts), npts // 2)
+    taper_sides = ss.windows.hann(2 * wlen + 1)
+    taper = np.ones(npts, dtype=np.float32)
+    taper[:wlen] = taper_sides[:wlen]
+    taper[npts - wlen:] = taper_sides[wlen + 1:]
+    return taper
+
+
+def process_slide(data, names, pairs, thisdate, nfft, dt, filters_key,
+                  params):
+    """Computes all the CCFs of one ``corr_duration`` window: PSDs and
+    whitening, pair indexing and the cross-, auto- and single-station
+    correlations for every filter. This function only works on plain arrays
+    and picklable parameters, so the windows of the slide loop can be
+    dispatched to a process pool (``compute_cc_workers`` > 1) as well as run
+    serially.
+
+    :returns: dict of {ccfid: CCF array} for this window.
+    """
+    out = {}
+
+    # TODO should not hardcode 100 taper points in spectrum
+    napod = 100
+
+    # index net.sta comps for energy later
+    channel_index = {}
+    if params.whitening != "N" and params.whitening_type == "PSD":
+        for i, name in enumerate(names):
+            n1, s1, l1, c1 = name
+            netsta = "%s.%s" % (n1, s1)
+            if netsta not in channel_index:
+                channel_index[netsta] = {}
+            channel_index[netsta][c1[-1]] = i
+
+        # one batched Welch estimate for all traces at once, instead
+        # of calling mlab.psd in a Python loop
+        psds = psd2(data, params.goal_sampling_rate, nfft)
+    else:
+        psds = np.zeros(1)
+
+    # average the E and N rows of each station in one gather/scatter pass
+    pair_rows = np.array([[chidx["E"], chidx["N"]]
+                          for chidx in channel_index.values()
+                          if "E" in chidx and "N" in chidx], dtype=int)
+    if len(pair_rows):
+        mm = psds[pair_rows].mean(axis=1)
+        psds[pair_rows[:, 0]] = mm
+        psds[pair_rows[:, 1]] = mm
+
+    # O(1) trace index lookups instead of names.index() linear scans per pair
+    name_idx = {tuple(name): i for i, name in enumerate(names)}
+
+    # Standard operator for CC
+    cc_index = []
+    if len(params.components_to_compute):
+        for sta1, sta2 in itertools.combinations(names, 2):
+            n1, s1, l1, c1 = sta1
+            n2, s2, l2, c2 = sta2
+            pair = "%s.%s:%s.%s" % (n1, s1, n2, s2)
+            if pair not in pairs:
+                continue
+            comp = "%s%s" % (c1[-1], c2[-1])
+            if comp in params.components_to_compute:
+                cc_index.append(
+                    ["%s.%s_%s.%s_%s" % (n1, s1, n2, s2, comp),
+                     name_idx[tuple(sta1)], name_idx[tuple(sta2)]])
+
+    # Different iterator func for single station AC or SC:
+    single_station_pair_index_sc = []
+    single_station_pair_index_ac = []
+
+    if len(params.components_to_compute_single_station):
+        for sta1, sta2 in itertools.combinations_with_replacement(names, 2):
+            n1, s1, l1, c1 = sta1
+            n2, s2, l2, c2 = sta2
+            if n1 != n2 or s1 != s2:
+                continue
+            pair = "%s.%s:%s.%s" % (n1, s1, n2, s2)
+            if pair not in pairs:
+                continue
+            comp = "%s%s" % (c1[-1], c2[-1])
+            if comp in params.components_to_compute_single_station:
+                if c1[-1] == c2[-1]:
+                    single_station_pair_index_ac.append(
+                        ["%s.%s_%s.%s_%s" % (n1, s1, n2, s2, comp),
+                         name_idx[tuple(sta1)], name_idx[tuple(sta2)]])
+                else:
+                # If the components are different, we can just
+                # process them using the default CC code (should warn)
+                    single_station_pair_index_sc.append(
+                        ["%s.%s_%s.%s_%s" % (n1, s1, n2, s2, comp),
+                         name_idx[tuple(sta1)], name_idx[tuple(sta2)]])
+            if comp[::-1] in params.components_to_compute_single_station:
+                if c1[-1] != c2[-1]:
+                    # If the components are different, we can just
+                    # process them using the default CC code (should warn)
+                    single_station_pair_index_sc.append(
+                        ["%s.%s_%s.%s_%s" % (n1, s1, n2, s2,
+                                             comp[::-1]),
+                         name_idx[tuple(sta2)], name_idx[tuple(sta1)]])
+
+    whiten_bounds = _whiten_bounds(nfft, dt, filters_key, napod)
+
+    # When whitening, the FFT of the raw data is the same for every filter
+    # (only the whitening bounds change): compute it once and give each
+    # filter its own copy to whiten, instead of one rFFT per filter
+    ffts_raw = None
+    if params.whitening != "N" and \
+            (len(cc_index) or len(single_station_pair_index_sc)):
+        ffts_raw = sf.rfft(data, n=nfft, axis=1, workers=-1)
+
+    for filterid, filterlow, filterhigh in filters_key:
+        low, high, p1, p2 = whiten_bounds[filterid]
+
+        _data = data
+        if params.whitening == "N":
+            # if the data doesn't need to be whitened, we can simply
+            # band-pass filter the traces now (on a copy, to keep the
+            # original data intact for the next filters):
+            _data = data.copy()
+            for i, _ in enumerate(_data):
+                _data[i] = bandpass(_, freqmin=filterlow,
+                                    freqmax=filterhigh,
+                                    df=params.goal_sampling_rate,
+                                    corners=8)
+
+        # whitened spectra and energies, shared by the CC and SC blocks
+        # below (they whiten identically)
+        ffts = None
+        if (len(cc_index) and params.cc_type == "CC") or \
+                (len(single_station_pair_index_sc) and
+                 params.cc_type_single_station_SC == "CC"):
+            if params.whitening != "N":
+                ffts = ffts_raw.copy()
+                whiten2(ffts, nfft, low, high, p1, p2, psds,
+                        params.whitening_type)  # inplace
+            else:
+                ffts = sf.rfft(_data, n=nfft, axis=1, workers=-1)
+            # RMS via Parseval, no need to go back to time domain
+            e2 = np.abs(ffts) ** 2
+            energy = 2 * e2.sum(axis=1) - e2[:, 0]
+            if nfft % 2 == 0:
+                energy -= e2[:, -1]
+            energy = np.sqrt(energy) / nfft
+
+        # First let's compute the AC and SC
+        if len(single_station_pair_index_ac):
+            tmp = _data.copy()
+            if params.whitening == "A":
+                # if the data isn't already filtered, we still need to
+                # do it for the AutoCorrelation:
+                for i, _ in enumerate(tmp):
+                    tmp[i] = bandpass(_, freqmin=filterlow,
+                                      freqmax=filterhigh,
+                                      df=params.goal_sampling_rate,
+                                      corners=8)
+            if params.cc_type_single_station_AC == "CC":
+                ffts_ac = sf.rfft(tmp, n=nfft, axis=1, workers=-1)
+                # RMS via Parseval, no need to go back to time domain
+                e2 = np.abs(ffts_ac) ** 2
+                energy_ac = 2 * e2.sum(axis=1) - e2[:, 0]
+                if nfft % 2 == 0:
+                    energy_ac -= e2[:, -1]
+                energy_ac = np.sqrt(energy_ac) / nfft
+
+                # Computing standard CC
+                corr = myCorr2(ffts_ac,
+                               np.ceil(params.maxlag / dt),
+                               energy_ac,
+                               single_station_pair_index_ac,
+                               plot=False,
+                               nfft=nfft)
+                del ffts_ac, energy_ac
+
+            elif params.cc_type_single_station_AC == "PCC":
+                corr = pcc_xcorr(tmp, np.ceil(params.maxlag / dt),
+                                 None, single_station_pair_index_ac)
+            else:
+                print("cc_type_single_station_AC = %s not implemented, "
+                      "exiting")
+                exit(1)
+
+            for key in corr:
+                ccfid = key + "_%02i" % filterid + "_" + thisdate
+                out[ccfid] = corr[key]
+            del corr
+
+        if len(cc_index):
+            if params.cc_type == "CC":
+                # Computing standard CC
+                corr = myCorr2(ffts,
+                               np.ceil(params.maxlag / dt),
+                               energy,
+                               cc_index,
+                               plot=False,
+                               nfft=nfft)
+
+                for key in corr:
+                    ccfid = key + "_%02i" % filterid + "_" + thisdate
+                    out[ccfid] = corr[key]
+                del corr
+            else:
+                print("cc_type = %s not implemented, "
+                      "exiting")
+                exit(1)
+
+        if len(single_station_pair_index_sc):
+            if params.cc_type_single_station_SC == "CC":
+                # logger.debug("Compute SC using %s" % params.cc_type)
+                # Computing standard CC, reusing the spectra whitened for
+                # the CC block above
+                corr = myCorr2(ffts,
+                               np.ceil(params.maxlag / dt),
+                               energy,
+                               single_station_pair_index_sc,
+                               plot=False,
+                               nfft=nfft)
+
+                for key in corr:
+                    ccfid = key + "_%02i" % filterid + "_" + thisdate
+                    out[ccfid] = corr[key]
+                del corr
+            else:
+                print("cc_type_single_station_SC = %s not implemented, "
+                      "exiting")
+                exit(1)
+
+        if ffts is not None:
+            del ffts, energy
+    return out
+
+
 def main(loglevel="INFO"):
     logger = logbook.Logger(__name__)
     # Reconfigure logger to show the pid number in log records
@@ -226,6 +492,8 @@ def main(loglevel="INFO"):
     # Get Configuration
     params = get_params(db)
     filters = get_filters(db, all=False)
+    # hashable summary of the filter set, used to cache the whitening bounds
+    filters_key = tuple((f.ref, float(f.low), float(f.high)) for f in filters)
     logger.info("Will compute [%s] for different stations" % " ".join(params.components_to_compute))
     logger.info("Will compute [%s] for single stations" % " ".join(params.components_to_compute_single_station))
 
@@ -242,6 +510,13 @@ def main(loglevel="INFO"):
         responses = preload_instrument_responses(db, return_format="inventory")
     else:
         responses = None
+
+    if params.compute_cc_workers > 1:
+        logger.info("Will process the sliding windows over %i processes"
+                    % params.compute_cc_workers)
+        executor = ProcessPoolExecutor(max_workers=params.compute_cc_workers)
+    else:
+        executor = None
     logger.info("Checking if there are jobs to do")
     while is_next_job(db, jobtype='CC'):
         logger.info("Getting the next job")
@@ -277,301 +552,158 @@ def main(loglevel="INFO"):
         if not len(stream):
             logger.debug("Not enough data for this day !")
             logger.debug("Marking job Done and continuing with next !")
-            for job in jobs:
-                update_job(db, job.day, job.pair, 'CC', 'D', ref=job.ref)
+            massive_update_job(db, jobs, "D")
             continue
         # print '##### STREAMS ARE ALL PREPARED AT goal Hz #####'
         dt = 1. / params.goal_sampling_rate
         logger.debug("Starting slides")
         start_processing = time.time()
         allcorr = {}
+        pending = []
+
+        # upper bound on the number of windows a day can produce, used to
+        # preallocate one 2D array per ccfid rather than nesting Python dicts
+        stream_start = min(tr.stats.starttime for tr in stream)
+        stream_end = max(tr.stats.endtime for tr in stream)
+        nwindows = int((stream_end - stream_start) /
+                       (params.corr_duration * (1 - params.overlap))) + 2
+
+        def merge_corrs(t, corrs):
+            # allcorr maps ccfid -> (2D array of CCFs, list of window times);
+            # windows are written at the next free row, in arrival order
+            for ccfid in corrs:
+                ccf = corrs[ccfid]
+                if ccfid not in allcorr:
+                    allcorr[ccfid] = (np.empty((nwindows, len(ccf)),
+                                               dtype=ccf.dtype), [])
+                corr_array, times = allcorr[ccfid]
+                corr_array[len(times)] = ccf
+                times.append(t)
+
+        # gap intervals per channel, computed once on the day-long stream:
+        # each slide below then only needs an interval-overlap test instead
+        # of a full tmp.get_gaps() Python scan per window
+        gap_intervals = {}
+        for gap in stream.get_gaps(min_gap=0):
+            if gap[-2] > 0:
+                chan = ".".join([gap[0], gap[1], gap[2], gap[3]])
+                gap_intervals.setdefault(chan, []).append((gap[4], gap[5]))
+        # data matrix reused from slide to slide, only reallocated when the
+        # window geometry (number of traces, npts) grows or changes.
+        # float32: preprocess outputs float32 traces, keep that width in the
+        # whole CC pipeline (the ffts then are complex64)
+        data_slab = np.empty((0, 0), dtype=np.float32)
         for tmp in stream.slide(params.corr_duration,
                                 params.corr_duration * (1 - params.overlap)):
             logger.debug("Processing %s - %s" % (tmp[0].stats.starttime,
                                                  tmp[0].stats.endtime))
-            tmp = tmp.copy().sort()
-
-            channels_to_remove = []
-            for gap in tmp.get_gaps(min_gap=0):
-                if gap[-2] > 0:
-                    channels_to_remove.append(
-                        ".".join([gap[0], gap[1], gap[2], gap[3]]))
-
-            for chan in np.unique(channels_to_remove):
+            tmp.sort()
+
+            win_start = tmp[0].stats.starttime
+            win_end = tmp[0].stats.endtime
+            channels_to_remove = set()
+            for chan, intervals in gap_intervals.items():
+                for gap_start, gap_end in intervals:
+                    if gap_start < win_end and gap_end > win_start:
+                        channels_to_remove.add(chan)
+                        break
+
+            for chan in channels_to_remove:
                 logger.debug("%s contains gap(s), removing it" % chan)
-                net, sta, loc, chan = chan.split(".")
-                for tr in tmp.select(network=net,
-                                     station=sta,
-                                     location=loc,
-                                     channel=chan):
-                    tmp.remove(tr)
-            if len(tmp) == 0:
+            # plain index filter instead of copying the Stream and calling
+            # tmp.remove() (O(N) per trace) for each rejected channel
+            traces = [tr for tr in tmp.traces
+                      if tr.id not in channels_to_remove]
+            if len(traces) == 0:
                 logger.debug("No traces without gaps")
                 continue
 
-            base = np.amax([tr.stats.npts for tr in tmp])
+            base = np.amax([tr.stats.npts for tr in traces])
             if base <= (params.maxlag*params.goal_sampling_rate*2+1):
                 logger.debug("All traces shorter are too short to export"
                               " +-maxlag")
                 continue
 
-            for tr in tmp:
-                if tr.stats.npts != base:
-                    tmp.remove(tr)
+            kept = []
+            for tr in traces:
+                if tr.stats.npts == base:
+                    kept.append(tr)
+                else:
                     logger.debug("One trace is too short, removing it")
+            traces = kept
+
+            nfft = next_fast_len(base)
+
+            # the traces data are views into the day-long stream: gather them
+            # into the reusable slab and preprocess that matrix in place, so
+            # the overlapping slides are left untouched
+            if data_slab.shape[0] < len(traces) or data_slab.shape[1] != base:
+                data_slab = np.empty((max(len(traces), data_slab.shape[0]),
+                                      base), dtype=np.float32)
+            data = data_slab[:len(traces)]
+            for k, tr in enumerate(traces):
+                np.copyto(data[k], tr.data, casting='same_kind')
+            data -= data.mean(axis=1, keepdims=True)  # demean
+            if params.windsorizing == -1:
+                np.sign(data, data)  # inplace
+            elif params.windsorizing != 0:
+                # same as the per-trace scoreatpercentile + masked std,
+                # but batched over all traces in a single numpy pass
+                imin, imax = np.percentile(data, [1, 99], axis=1)
+                not_outliers = (data >= imin[:, np.newaxis]) & \
+                               (data <= imax[:, np.newaxis])
+                nvalid = not_outliers.sum(axis=1)
+                mean = (data * not_outliers).sum(axis=1) / nvalid
+                var = ((data - mean[:, np.newaxis]) ** 2 *
+                       not_outliers).sum(axis=1) / nvalid
+                rms = np.sqrt(var) * params.windsorizing
+                np.clip(data, -rms[:, np.newaxis], rms[:, np.newaxis],
+                        data)  # inplace
+            # TODO should not hardcode 4 percent!
+            data *= _taper(base, 0.04)
 
-            if len(tmp) == 0:
-                logger.debug("No traces left in slice")
-                continue
+            names = [tr.id.split(".") for tr in traces]
 
-            nfft = next_fast_len(tmp[0].stats.npts)
-            tmp.detrend("demean")
-
-            for tr in tmp:
-                if params.windsorizing == -1:
-                    np.sign(tr.data, tr.data)  # inplace
-                elif params.windsorizing != 0:
-                    imin, imax = scoreatpercentile(tr.data, [1, 99])
-                    not_outliers = np.where((tr.data >= imin) &
-                                            (tr.data <= imax))[0]
-                    rms = tr.data[not_outliers].std() * params.windsorizing
-                    np.clip(tr.data, -rms, rms, tr.data)  # inplace
-            # TODO should not hardcode 4 percent!
-            tmp.taper(0.04)
-
-            # TODO should not hardcode 100 taper points in spectrum
-            napod = 100
-
-            data = np.asarray([tr.data for tr in tmp])
-            names = [tr.id.split(".") for tr in tmp]
-
-            # index net.sta comps for energy later
-            channel_index = {}
-            if params.whitening != "N" and params.whitening_type == "PSD":
-                psds = []
-                for i, name in enumerate(names):
-                    n1, s1, l1, c1 = name
-                    netsta = "%s.%s" % (n1, s1)
-                    if netsta not in channel_index:
-                        channel_index[netsta] = {}
-                    channel_index[netsta][c1[-1]] = i
-    
-                    pxx, freqs = mlab.psd(tmp[i].data,
-                                          Fs=tmp[i].stats.sampling_rate,
-                                          NFFT=nfft,
-                                          detrend='mean')
-                    psds.append(np.sqrt(pxx))
-                psds = np.asarray(psds)
-            else:
-                psds = np.zeros(1)
-
-            for chan in channel_index:
-                comps = channel_index[chan].keys()
-                if "E" in comps and "N" in comps:
-                    i_e = channel_index[chan]["E"]
-                    i_n = channel_index[chan]["N"]
-                    # iZ = channel_index[chan]["Z"]
-                    mm = psds[[i_e,i_n]].mean(axis=0)
-                    psds[i_e] = mm
-                    psds[i_n] = mm
-                    # psds[iZ] = mm
-
-            # define pairwise CCs
-            tmptime = tmp[0].stats.starttime.datetime
+            tmptime = traces[0].stats.starttime.datetime
             thisdate = tmptime.strftime("%Y-%m-%d")
             thistime = tmptime.strftime("%Y-%m-%d %H:%M:%S")
 
-            # Standard operator for CC
-            cc_index = []
-            if len(params.components_to_compute):
-                for sta1, sta2 in itertools.combinations(names, 2):
-                    n1, s1, l1, c1 = sta1
-                    n2, s2, l2, c2 = sta2
-                    pair = "%s.%s:%s.%s" % (n1, s1, n2, s2)
-                    if pair not in pairs:
-                        continue
-                    comp = "%s%s" % (c1[-1], c2[-1])
-                    if comp in params.components_to_compute:
-                        cc_index.append(
-                            ["%s.%s_%s.%s_%s" % (n1, s1, n2, s2, comp),
-                             names.index(sta1), names.index(sta2)])
-
-            # Different iterator func for single station AC or SC:
-            single_station_pair_index_sc = []
-            single_station_pair_index_ac = []
-
-            if len(params.components_to_compute_single_station):
-                for sta1, sta2 in itertools.combinations_with_replacement(names, 2):
-                    n1, s1, l1, c1 = sta1
-                    n2, s2, l2, c2 = sta2
-                    if n1 != n2 or s1 != s2:
-                        continue
-                    pair = "%s.%s:%s.%s" % (n1, s1, n2, s2)
-                    if pair not in pairs:
-                        continue
-                    comp = "%s%s" % (c1[-1], c2[-1])
-                    if comp in params.components_to_compute_single_station:
-                        if c1[-1] == c2[-1]:
-                            single_station_pair_index_ac.append(
-                                ["%s.%s_%s.%s_%s" % (n1, s1, n2, s2, comp),
-                                 names.index(sta1), names.index(sta2)])
-                        else:
-                        # If the components are different, we can just
-                        # process them using the default CC code (should warn)
-                            single_station_pair_index_sc.append(
-                                ["%s.%s_%s.%s_%s" % (n1, s1, n2, s2, comp),
-                                 names.index(sta1), names.index(sta2)])
-                    if comp[::-1] in params.components_to_compute_single_station:
-                        if c1[-1] != c2[-1]:
-                            # If the components are different, we can just
-                            # process them using the default CC code (should warn)
-                            single_station_pair_index_sc.append(
-                                ["%s.%s_%s.%s_%s" % (n1, s1, n2, s2, 
-                                                     comp[::-1]),
-                                 names.index(sta2), names.index(sta1)])
-
-            for filterdb in filters:
-                filterid = filterdb.ref
-                filterlow = float(filterdb.low)
-                filterhigh = float(filterdb.high)
-
-                freq_vec = sf.fftfreq(nfft, d=dt)[:nfft // 2]
-                freq_sel = np.where((freq_vec >= filterlow) & (freq_vec <= filterhigh))[0]
-                low = freq_sel[0] - napod
-                if low <= 0:
-                    low = 0
-                p1 = freq_sel[0]
-                p2 = freq_sel[-1]
-                high = freq_sel[-1] + napod
-                if high > nfft / 2:
-                    high = int(nfft // 2)
-
-                # Make a copy of the original data to prevent modifying it
-                _data = data.copy()
-                if params.whitening == "N":
-                    # if the data doesn't need to be whitened, we can simply
-                    # band-pass filter the traces now:
-                    for i, _ in enumerate(_data):
-                        _data[i] = bandpass(_, freqmin=filterlow,
-                                            freqmax=filterhigh,
-                                            df=params.goal_sampling_rate,
-                                            corners=8)
-
-                # First let's compute the AC and SC
-                if len(single_station_pair_index_ac):
-                    tmp = _data.copy()
-                    if params.whitening == "A":
-                        # if the data isn't already filtered, we still need to
-                        # do it for the AutoCorrelation:
-                        for i, _ in enumerate(tmp):
-                            tmp[i] = bandpass(_, freqmin=filterlow,
-                                              freqmax=filterhigh,
-                                              df=params.goal_sampling_rate,
-                                              corners=8)
-                    if params.cc_type_single_station_AC == "CC":
-                        ffts = sf.fftn(tmp, [nfft, ], axes=[1, ])
-                        energy = np.real(np.sqrt(np.mean(
-                            sf.ifft(ffts, n=nfft, axis=1) ** 2,
-                            axis=1)))
-
-                        # Computing standard CC
-                        corr = myCorr2(ffts,
-                                       np.ceil(params.maxlag / dt),
-                                       energy,
-                                       single_station_pair_index_ac,
-                                       plot=False,
-                                       nfft=nfft)
-
-                    elif params.cc_type_single_station_AC == "PCC":
-                        corr = pcc_xcorr(tmp, np.ceil(params.maxlag / dt),
-                                         None, single_station_pair_index_ac)
-                    else:
-                        print("cc_type_single_station_AC = %s not implemented, "
-                              "exiting")
-                        exit(1)
-
-                    for key in corr:
-                        ccfid = key + "_%02i" % filterid + "_" + thisdate
-                        if ccfid not in allcorr:
-                            allcorr[ccfid] = {}
-                        allcorr[ccfid][thistime] = corr[key]
-                    del corr, energy
-
-                if len(cc_index):
-                    if params.cc_type == "CC":
-                        ffts = sf.fftn(_data, [nfft, ], axes=[1, ])
-                        if params.whitening != "N":
-                            whiten2(ffts, nfft, low, high, p1, p2, psds,
-                                    params.whitening_type)  # inplace
-                        # energy = np.sqrt(np.sum(np.abs(ffts)**2, axis=1)/nfft)
-                        energy = np.real(np.sqrt( np.mean(sf.ifft(ffts, n=nfft, axis=1) ** 2, axis=1)))
-        
-                        # logger.info("Pre-whitened %i traces"%(i+1))
-                        # Computing standard CC
-                        corr = myCorr2(ffts,
-                                       np.ceil(params.maxlag / dt),
-                                       energy,
-                                       cc_index,
-                                       plot=False,
-                                       nfft=nfft)
-                        
-                        for key in corr:
-                            ccfid = key + "_%02i" % filterid + "_" + thisdate
-                            if ccfid not in allcorr:
-                                allcorr[ccfid] = {}
-                            allcorr[ccfid][thistime] = corr[key]
-                        del corr, energy, ffts
-                    else:
-                        print("cc_type = %s not implemented, "
-                              "exiting")
-                        exit(1)
-
-                if len(single_station_pair_index_sc):
-                    if params.cc_type_single_station_SC == "CC":
-                        # logger.debug("Compute SC using %s" % params.cc_type)
-                        ffts = sf.fftn(_data, [nfft, ], axes=[1, ])
-                        if params.whitening != "N":
-                            whiten2(ffts, nfft, low, high, p1, p2, psds,
-                                    params.whitening_type)  # inplace
-                        # energy = np.sqrt(np.sum(np.abs(ffts)**2, axis=1)/nfft)
-                        energy = np.real(np.sqrt(np.mean(
-                            sf.ifft(ffts, n=nfft, axis=1) ** 2,
-                            axis=1)))
-
-                        # logger.info("Pre-whitened %i traces"%(i+1))
-                        # Computing standard CC
-                        corr = myCorr2(ffts,
-                                       np.ceil(params.maxlag / dt),
-                                       energy,
-                                       single_station_pair_index_sc,
-                                       plot=False,
-                                       nfft=nfft)
-
-                        for key in corr:
-                            ccfid = key + "_%02i" % filterid + "_" + thisdate
-                            if ccfid not in allcorr:
-                                allcorr[ccfid] = {}
-                            allcorr[ccfid][thistime] = corr[key]
-                        del corr, energy, ffts
-                    else:
-                        print("cc_type_single_station_SC = %s not implemented, "
-                              "exiting")
-                        exit(1)
-            del psds
-        # Needed to clean the FFT memory caching of SciPy
-        clean_scipy_cache()
+            if executor is None:
+                merge_corrs(thistime, process_slide(
+                    data, names, pairs, thisdate, nfft, dt, filters_key,
+                    params))
+            else:
+                # each window is independent: ship a copy of the slab (it is
+                # refilled at the next slide) to the process pool and merge
+                # the finished windows as they come back
+                pending.append((thistime, executor.submit(
+                    process_slide, np.array(data), names, pairs, thisdate,
+                    nfft, dt, filters_key, params)))
+                while len(pending) >= 2 * params.compute_cc_workers:
+                    t, future = pending.pop(0)
+                    merge_corrs(t, future.result())
+        for t, future in pending:
+            merge_corrs(t, future.result())
+        pending = []
 
         if params.keep_all:
             for ccfid in allcorr.keys():
-                export_allcorr2(db, ccfid, allcorr[ccfid])
+                corr_array, times = allcorr[ccfid]
+                export_allcorr2(db, ccfid,
+                                dict(zip(times, corr_array[:len(times)])))
 
         if params.keep_days:
-            for ccfid in allcorr.keys():
+            # pop the CCFs one by one so the memory of each pair is
+            # released as soon as its daily stack is written, instead of
+            # keeping the whole day in RAM until the end of the loop
+            while len(allcorr):
+                ccfid, (corr_array, times) = allcorr.popitem()
                 # print("Exporting %s" % ccfid)
                 station1, station2, components, filterid, date = \
                     ccfid.split('_')
 
-                corrs = np.asarray(list(allcorr[ccfid].values()))
+                corrs = corr_array[:len(times)]
+                del corr_array
                 if not len(corrs):
                     logger.debug("No data to stack.")
                     continue
@@ -592,15 +724,17 @@ def main(loglevel="INFO"):
                     ncorr=corrs.shape[0],
                     params=params)
 
-        # THIS SHOULD BE IN THE API
         massive_update_job(db, jobs, "D")
         if not params.hpc:
-            for job in jobs:
-                update_job(db, job.day, job.pair, 'STACK', 'T')
+            # flip all the STACK jobs of the day in two statements instead
+            # of one update_job() roundtrip per pair
+            massive_update_or_insert_job(db, goal_day, pairs, 'STACK', 'T')
 
         logger.info("Job Finished. It took %.2f seconds (preprocess: %.2f s & "
                      "process %.2f s)" % ((time.time() - jt),
                                           start_processing - jt,
                                           time.time() - start_processing))
         del stream, allcorr
+    if executor is not None:
+        executor.shutdown()
     logger.info('*** Finished: Compute CC ***')
@@ -6,8 +6,8 @@ setup(version="1.6",
       include_package_data=True,
       install_requires=[
           'setuptools',
-          'numpy>=1.0',
-          'scipy',
+          'numpy>=1.20',
+          'scipy>=1.4',
           'pandas',
           'matplotlib',
           'sqlalchemy',